@@ -5,14 +5,21 @@ A professional, reliable Scribd document downloader bot
 Deployment-ready for Railway & cloud platforms
 """
 
+import io
 import os
 import re
 import logging
 import asyncio
-from typing import Optional, Dict, Any
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
+from urllib.parse import urlsplit
 import aiohttp
-from telegram import Update, InputFile
+import orjson
+from telegram import Update
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -21,7 +28,6 @@ from telegram.ext import (
     ContextTypes
 )
 from telegram.constants import ParseMode
-import json
 
 # ========== CONFIGURATION ==========
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # Set in Railway environment
@@ -34,188 +40,435 @@ DOWNLOAD_SERVICES = [
     "https://scribd-downloader-api.herokuapp.com/download",
     "https://scribd-dl.onrender.com/api/download",
 ]
+FALLBACK_DOWNLOAD_URL = "https://scribd-downloader.co/download/{doc_id}"
+
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB Telegram limit
+PDF_CHUNK_SIZE = 64 * 1024
+PDF_MAGIC = b'%PDF'
+
+# Shared HTTP client settings (one session for the whole bot)
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json, text/html, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'DNT': '1',
+}
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Separate connect and read budgets so a hung handshake fails fast;
+# connect also bounds the wait for a free pooled connection
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=45, connect=10, sock_connect=5, sock_read=30)
+
+# Per-service API calls: fail fast on connect, retry transient errors once
+SERVICE_TIMEOUT = aiohttp.ClientTimeout(total=20, sock_connect=3, sock_read=15)
+SERVICE_ATTEMPTS = 2
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 5.0  # cap on an upstream Retry-After, keeps retries inside the user's wait
+TRANSIENT_ERRORS = (
+    aiohttp.ClientConnectorError,
+    aiohttp.ServerDisconnectedError,
+    asyncio.TimeoutError,
+)
+
+# Circuit breaker: skip a service after repeated failures, probe again later
+FAIL_THRESHOLD = 5      # consecutive failures before the circuit opens
+OPEN_WINDOW = 30.0      # seconds to skip an open service before probing
+BREAKERS = {
+    url: {'state': 'closed', 'fails': 0, 'opened_at': 0.0, 'lock': asyncio.Lock()}
+    for url in DOWNLOAD_SERVICES
+}
+
+# Downloads currently in progress, keyed by document ID
+_INFLIGHT: Dict[str, asyncio.Task] = {}
+
+# Recently downloaded PDFs: doc_id -> (stored_at, data), least recent first
+CACHE_LIMIT = 200 * 1024 * 1024  # total bytes kept in memory
+CACHE_TTL = 3600.0               # seconds before an entry is refetched
+_PDF_CACHE: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+_CACHE_BYTES = 0
+
+# Bulkhead: one active download per user (DOWNLOAD_WORKERS caps the total)
+_ACTIVE_USERS = set()
+
+# Per-host request cap for the known upstreams, taken before the request so
+# queueing doesn't eat the timeout
+MAX_PER_HOST = 8
+_HOST_SLOTS: Dict[str, asyncio.Semaphore] = {
+    urlsplit(url).hostname: asyncio.Semaphore(MAX_PER_HOST)
+    for url in DOWNLOAD_SERVICES + [FALLBACK_DOWNLOAD_URL]
+}
+
+# Download queue: handlers enqueue and return, a fixed pool of workers downloads.
+# The worker count is the global cap on concurrent downloads.
+DOWNLOAD_QUEUE_SIZE = 100
+DOWNLOAD_WORKERS = 8
+
+# Seconds a download may run before the user gets a "processing" message
+PROCESSING_MSG_DELAY = 2.0
 
 # Enable detailed logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
+    # stdout only: the platform collects it, and file writes would block the event loop
     handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log')
+        logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
 # ========== UTILITY FUNCTIONS ==========
-def validate_scribd_url(url: str) -> bool:
-    """Validate if URL is a proper Scribd link"""
-    patterns = [
-        r'https?://(?:www\.)?scribd\.com/(?:doc|document|presentation)/(\d+)',
-        r'https?://(?:www\.)?scribd\.com/doc/(\d+)',
-        r'https?://(?:www\.)?scribd\.com/document/(\d+)(?:/[^/?]+)?',
-        r'https?://(?:www\.)?scribd\.com/presentation/(\d+)',
-    ]
-    return any(re.search(pattern, url, re.IGNORECASE) for pattern in patterns)
-
-def extract_document_id(url: str) -> Optional[str]:
-    """Extract document ID from Scribd URL"""
-    patterns = [
-        r'scribd\.com/(?:doc|document|presentation)/(\d+)',
-        r'/doc/(\d+)',
-        r'/document/(\d+)',
-        r'/presentation/(\d+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url, re.IGNORECASE)
-        if match:
-            return match.group(1)
+# Compiled once at import instead of on every message
+_DIGITS = re.compile(r'\d+')
+_SANITIZE_NONWORD = re.compile(r'[^\w\s-]')
+_SANITIZE_SEP = re.compile(r'[-\s]+')
+# ASCII fast path for sanitize_filename: drop what [^\w\s-] drops, map [-\s] to '_'
+_SANITIZE_TABLE = {
+    code: '_' if chr(code).isspace() or chr(code) == '-' else None
+    for code in range(128)
+    if not (chr(code).isalnum() or chr(code) == '_')
+}
+
+_SCRIBD_HOST = 'scribd.com/'
+_SCRIBD_SCHEMES = ('http://', 'https://', 'http://www.', 'https://www.')
+_DOC_PREFIXES = ('doc/', 'document/', 'presentation/')
+
+def _find_document_id(low: str) -> Optional[str]:
+    """Return the document ID from the first valid Scribd link in lowercased text"""
+    # Offsets and digits both come from `low`: lower() can change the length
+    # of non-ASCII text, but never touches digits
+    i = low.find(_SCRIBD_HOST)
+    while i >= 0:
+        if low.endswith(_SCRIBD_SCHEMES, 0, i):
+            start = i + len(_SCRIBD_HOST)
+            for prefix in _DOC_PREFIXES:
+                if low.startswith(prefix, start):
+                    match = _DIGITS.match(low, start + len(prefix))
+                    if match:
+                        return match.group()
+        i = low.find(_SCRIBD_HOST, i + 1)
     return None
 
+def parse_scribd_url(url: str) -> Optional[str]:
+    """Validate a Scribd link and return its document ID in a single pass"""
+    return _find_document_id(url.lower())
+
+# Characters with meaning in Telegram's legacy Markdown, escaped in one C-level pass
+_MARKDOWN_ESCAPE = str.maketrans({c: '\\' + c for c in '_*`['})
+
+def is_pdf(data) -> bool:
+    """Check the PDF magic bytes in place (no slice copy)"""
+    return data.startswith(PDF_MAGIC)
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry `attempt`, honouring a Retry-After header"""
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            seconds = None  # HTTP-date form, fall back to backoff
+        # 'nan'/'inf' parse as floats, but asyncio.sleep (uvloop) rejects nan
+        if seconds is not None and math.isfinite(seconds):
+            return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+    # Exponential backoff with jitter
+    return 0.25 * (2 ** (attempt - 1)) + random.random() * 0.25
+
+def escape_markdown(text: str) -> str:
+    """Escape user/upstream text for ParseMode.MARKDOWN messages"""
+    return text.translate(_MARKDOWN_ESCAPE)
+
 def sanitize_filename(name: str) -> str:
     """Clean filename for safe use"""
-    name = re.sub(r'[^\w\s-]', '', name)
-    name = re.sub(r'[-\s]+', '_', name)
+    if name.isascii():
+        name = name.translate(_SANITIZE_TABLE)
+    else:
+        # Unicode letters and whitespace need the regex definitions
+        name = _SANITIZE_NONWORD.sub('', name)
+        name = _SANITIZE_SEP.sub('_', name)
+    while '__' in name:
+        name = name.replace('__', '_')
     name = name.strip('_')
     if not name.lower().endswith('.pdf'):
         name += '.pdf'
     return name[:60]  # Telegram filename limit
 
+def host_slot(url: str) -> asyncio.Semaphore:
+    """Return the semaphore limiting concurrent requests to a known upstream host"""
+    return _HOST_SLOTS[urlsplit(url).hostname]
+
+# ========== PDF CACHE ==========
+# Cache operations never await, so they are atomic on the event loop
+def cache_get(doc_id: str) -> Optional[bytes]:
+    """Return a cached PDF if present and not expired"""
+    global _CACHE_BYTES
+    entry = _PDF_CACHE.get(doc_id)
+    if entry is None:
+        return None
+    stored_at, data = entry
+    if time.monotonic() - stored_at > CACHE_TTL:
+        del _PDF_CACHE[doc_id]
+        _CACHE_BYTES -= len(data)
+        return None
+    _PDF_CACHE.move_to_end(doc_id)
+    return data
+
+def cache_put(doc_id: str, data: bytes):
+    """Store a PDF, evicting least recently used entries to stay under CACHE_LIMIT"""
+    global _CACHE_BYTES
+    if len(data) > CACHE_LIMIT:
+        return
+    old = _PDF_CACHE.pop(doc_id, None)
+    if old:
+        _CACHE_BYTES -= len(old[1])
+    while _PDF_CACHE and _CACHE_BYTES + len(data) > CACHE_LIMIT:
+        _, (_, evicted) = _PDF_CACHE.popitem(last=False)
+        _CACHE_BYTES -= len(evicted)
+    _PDF_CACHE[doc_id] = (time.monotonic(), data)
+    _CACHE_BYTES += len(data)
+
 # ========== SCRIBD DOWNLOADER CLASS ==========
+class FileTooLarge(Exception):
+    """Raised when a PDF exceeds MAX_FILE_SIZE; size is None if the stream was cut short"""
+    
+    def __init__(self, size: Optional[int] = None):
+        super().__init__(size)
+        self.size = size
+
 class ScribdDownloader:
     """Professional Scribd Downloader with multiple service fallbacks"""
     
-    def __init__(self):
-        self.session = None
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'application/json, text/html, */*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'DNT': '1',
-        }
-        self.timeout = aiohttp.ClientTimeout(total=45)
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+    
+    async def download_from_service(self, payload: bytes, service_url: str) -> Optional[bytes]:
+        """Try downloading from a specific service, honouring its circuit breaker"""
+        breaker = BREAKERS[service_url]
+        async with breaker['lock']:
+            if breaker['state'] == 'open':
+                if time.monotonic() - breaker['opened_at'] < OPEN_WINDOW:
+                    logger.debug("Service %s skipped: circuit open", service_url)
+                    return None
+                # Cooldown elapsed, let a single probe through
+                breaker['state'] = 'half_open'
+            elif breaker['state'] == 'half_open':
+                # Another request is already probing this service
+                return None
         
-    async def __aenter__(self):
-        await self.create_session()
-        return self
+        too_large = None
+        try:
+            pdf_data, healthy = await self._request_service(payload, service_url)
+        except FileTooLarge as e:
+            # The service delivered, the document is just too big to send
+            pdf_data, healthy, too_large = None, True, e
+        except Exception as e:
+            # Unexpected error, count it as a fault so a probe is always resolved
+            logger.warning("Service %s raised unexpectedly: %r", service_url, e)
+            pdf_data, healthy = None, False
+        except BaseException:
+            # Cancelled (lost the race) or shutting down, don't count it either way.
+            # No await here, so the probe is released even if cancelled again.
+            if breaker['state'] == 'half_open':
+                breaker['state'] = 'open'
+            raise
         
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.close_session()
-    
-    async def create_session(self):
-        """Create aiohttp session"""
-        if not self.session:
-            self.session = aiohttp.ClientSession(
-                headers=self.headers,
-                timeout=self.timeout
-            )
+        # Only transport errors and bad statuses count against the service; a
+        # proper "document unavailable" answer or a rejected body does not
+        async with breaker['lock']:
+            if healthy:
+                breaker['state'] = 'closed'
+                breaker['fails'] = 0
+            else:
+                breaker['fails'] += 1
+                if breaker['state'] == 'half_open' or breaker['fails'] >= FAIL_THRESHOLD:
+                    if breaker['state'] != 'open':
+                        logger.warning("Circuit opened for service %s", service_url)
+                    breaker['state'] = 'open'
+                    breaker['opened_at'] = time.monotonic()
+        if too_large is not None:
+            raise too_large
+        return pdf_data
     
-    async def close_session(self):
-        """Close aiohttp session"""
-        if self.session:
-            await self.session.close()
-            self.session = None
+    async def _request_service(self, payload: bytes, service_url: str) -> Tuple[Optional[bytes], bool]:
+        """Perform the actual service request, retrying transient errors
+        Returns: (pdf bytes or None, whether the service itself responded properly)
+        """
+        # The download endpoints are read-only, so retrying the POST is safe
+        retry_after = None
+        for attempt in range(SERVICE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(retry_delay(attempt, retry_after))
+                retry_after = None
+                logger.debug("Retrying service %s (attempt %d/%d)", service_url, attempt + 1, SERVICE_ATTEMPTS)
+            try:
+                async with host_slot(service_url):
+                    async with self.session.post(
+                        service_url,
+                        data=payload,
+                        headers=JSON_HEADERS,
+                        timeout=SERVICE_TIMEOUT
+                    ) as response:
+                        if response.status in RETRY_STATUSES:
+                            logger.debug("Service %s returned HTTP %s", service_url, response.status)
+                            retry_after = response.headers.get('Retry-After')
+                            continue
+                        if response.status != 200:
+                            logger.debug("Service %s returned HTTP %s", service_url, response.status)
+                            return None, False
+                        data = await response.json(loads=orjson.loads)
+                if not (data.get('success') and data.get('pdf_url')):
+                    # Private or unavailable document, the service is fine
+                    return None, True
+                # Download the PDF. Its host varies per download (CDNs, signed links),
+                # so only the connector's limit_per_host applies here
+                async with self.session.get(data['pdf_url']) as pdf_response:
+                    if pdf_response.status != 200:
+                        logger.debug("Service %s PDF link returned HTTP %s", service_url, pdf_response.status)
+                        return None, False
+                    # Non-PDF or oversized bodies are per-document, not service faults
+                    return await self.read_pdf(pdf_response), True
+            except FileTooLarge:
+                raise
+            except TRANSIENT_ERRORS as e:
+                logger.debug("Service %s failed: %r", service_url, e)
+            except Exception as e:
+                logger.debug("Service %s failed: %s", service_url, e)
+                return None, False
+        # Retries exhausted on transient errors or retryable statuses
+        return None, False
     
-    async def download_from_service(self, doc_id: str, service_url: str) -> Optional[bytes]:
-        """Try downloading from a specific service"""
-        try:
-            async with self.session.post(
-                service_url,
-                json={'url': f'https://scribd.com/document/{doc_id}'},
-                timeout=30
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and data.get('pdf_url'):
-                        # Download the PDF
-                        async with self.session.get(data['pdf_url'], timeout=30) as pdf_response:
-                            if pdf_response.status == 200:
-                                return await pdf_response.read()
-        except Exception as e:
-            logger.debug(f"Service {service_url} failed: {e}")
+    async def read_pdf(self, response: aiohttp.ClientResponse) -> Optional[bytes]:
+        """Stream a PDF body, aborting early on non-PDF or oversized responses
+        Raises FileTooLarge instead of returning None for oversized bodies
+        """
+        # Known-oversized bodies are rejected before reading a single chunk
+        if response.content_length is not None and response.content_length > MAX_FILE_SIZE:
+            logger.warning("Skipping download from %s: Content-Length %d exceeds %d bytes",
+                           response.url, response.content_length, MAX_FILE_SIZE)
+            response.close()
+            raise FileTooLarge(response.content_length)
+        buf = bytearray()
+        async for chunk in response.content.iter_chunked(PDF_CHUNK_SIZE):
+            if len(buf) + len(chunk) > MAX_FILE_SIZE:
+                logger.warning("Aborting download from %s: larger than %d bytes", response.url, MAX_FILE_SIZE)
+                response.close()
+                raise FileTooLarge()
+            checked = len(buf) >= len(PDF_MAGIC)
+            buf.extend(chunk)
+            if not checked and len(buf) >= len(PDF_MAGIC) and not is_pdf(buf):
+                # Error page instead of a PDF, don't read the rest
+                response.close()
+                return None
+        if not is_pdf(buf):
             return None
-        return None
+        return bytes(buf)
     
-    async def direct_download(self, scribd_url: str) -> Optional[bytes]:
+    async def direct_download(self, doc_id: str) -> Optional[bytes]:
         """Try direct download methods"""
         try:
             # Method 1: Try common API endpoints
-            doc_id = extract_document_id(scribd_url)
-            if not doc_id:
-                return None
+            # Serialize the request body once for every service and retry
+            payload = orjson.dumps({'url': f'https://scribd.com/document/{doc_id}'})
             
-            # Try multiple services
+            # Race all services concurrently, first valid PDF wins
+            pending = {}
             for service_url in DOWNLOAD_SERVICES:
-                logger.info(f"Trying service: {service_url}")
-                pdf_data = await self.download_from_service(doc_id, service_url)
-                if pdf_data and pdf_data[:4] == b'%PDF':
-                    logger.info(f"Success from service: {service_url}")
-                    return pdf_data
+                logger.debug("Trying service: %s", service_url)
+                task = asyncio.create_task(self.download_from_service(payload, service_url))
+                pending[task] = service_url
+            try:
+                while pending:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        service_url = pending.pop(task)
+                        # Raises FileTooLarge, no other service will have a smaller copy
+                        pdf_data = task.result()
+                        # read_pdf only returns bodies that passed is_pdf
+                        if pdf_data:
+                            logger.debug("Success from service: %s", service_url)
+                            return pdf_data
+            finally:
+                # Cancel the slower services once we have a winner
+                for task in pending:
+                    task.cancel()
             
             # Method 2: Try alternative approach
-            alt_url = f"https://scribd-downloader.co/download/{doc_id}"
-            async with self.session.get(alt_url, allow_redirects=True) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    if content[:4] == b'%PDF':
-                        return content
+            alt_url = FALLBACK_DOWNLOAD_URL.format(doc_id=doc_id)
+            retry_after = None
+            for attempt in range(SERVICE_ATTEMPTS):
+                if attempt:
+                    await asyncio.sleep(retry_delay(attempt, retry_after))
+                async with host_slot(alt_url):
+                    async with self.session.get(alt_url, allow_redirects=True) as response:
+                        if response.status in RETRY_STATUSES:
+                            logger.debug("Fallback %s returned HTTP %s", alt_url, response.status)
+                            retry_after = response.headers.get('Retry-After')
+                            continue
+                        if response.status == 200:
+                            return await self.read_pdf(response)
+                        return None
             
             return None
             
+        except FileTooLarge:
+            raise
         except Exception as e:
-            logger.error(f"Direct download error: {e}")
+            logger.error("Direct download error: %s", e)
             return None
     
+    async def coalesced_download(self, doc_id: str) -> Optional[bytes]:
+        """Share one upstream download between concurrent requests for the same document"""
+        # No await between the lookup and the insert, so no lock is needed
+        task = _INFLIGHT.get(doc_id)
+        if task is not None:
+            logger.info("Joining in-flight download for document %s", doc_id)
+        else:
+            # Run the fetch as its own task so a cancelled caller can't abort it for the others
+            task = asyncio.create_task(self.fetch_and_cache(doc_id))
+            _INFLIGHT[doc_id] = task
+            task.add_done_callback(lambda _: _INFLIGHT.pop(doc_id, None))
+        return await asyncio.shield(task)
+    
+    async def fetch_and_cache(self, doc_id: str) -> Optional[bytes]:
+        """Download a document upstream and cache it on success"""
+        pdf_data = await self.direct_download(doc_id)
+        if pdf_data:
+            cache_put(doc_id, pdf_data)
+        return pdf_data
+    
     async def download_document(self, scribd_url: str) -> Dict[str, Any]:
         """
         Main download function with comprehensive error handling
         Returns: {'success': bool, 'data': bytes or None, 'filename': str, 'error': str}
         """
-        await self.create_session()
-        
         try:
-            # Validate URL
-            if not validate_scribd_url(scribd_url):
-                return {
-                    'success': False,
-                    'data': None,
-                    'filename': '',
-                    'error': 'Invalid Scribd URL format'
-                }
-            
-            doc_id = extract_document_id(scribd_url)
+            # Validate URL and extract the document ID in one pass
+            doc_id = parse_scribd_url(scribd_url)
             if not doc_id:
                 return {
                     'success': False,
                     'data': None,
                     'filename': '',
-                    'error': 'Could not extract document ID'
+                    'error': 'Invalid Scribd URL format'
                 }
             
-            logger.info(f"Processing document ID: {doc_id}")
+            logger.info("Processing document ID: %s", doc_id)
             
-            # Try download
-            start_time = datetime.now()
-            pdf_data = await self.direct_download(scribd_url)
-            elapsed = (datetime.now() - start_time).total_seconds()
+            # Try cache first, then download
+            start = time.monotonic()
+            pdf_data = cache_get(doc_id)
+            if pdf_data is not None:
+                logger.info("Cache hit for document %s", doc_id)
+            else:
+                pdf_data = await self.coalesced_download(doc_id)
+            elapsed = time.monotonic() - start
             
             if pdf_data:
-                # Check file size
+                # read_pdf already enforced MAX_FILE_SIZE
                 file_size = len(pdf_data)
-                if file_size > 50 * 1024 * 1024:  # 50MB Telegram limit
-                    return {
-                        'success': False,
-                        'data': None,
-                        'filename': f'document_{doc_id}.pdf',
-                        'error': f'File too large ({file_size/1024/1024:.1f}MB). Max 50MB.'
-                    }
                 
                 # Generate filename
                 filename = f'scribd_document_{doc_id}.pdf'
                 
-                logger.info(f"Download successful: {file_size} bytes in {elapsed:.1f}s")
+                logger.info("Download successful: %d bytes in %.1fs", file_size, elapsed)
                 
                 return {
                     'success': True,
@@ -232,6 +485,14 @@ class ScribdDownloader:
                     'error': 'Document could not be downloaded. It might require subscription or be private.'
                 }
                 
+        except FileTooLarge as e:
+            size = f'{e.size/1024/1024:.1f}MB' if e.size else 'over 50MB'
+            return {
+                'success': False,
+                'data': None,
+                'filename': f'document_{doc_id}.pdf',
+                'error': f'File too large ({size}). Max 50MB.'
+            }
         except asyncio.TimeoutError:
             return {
                 'success': False,
@@ -240,7 +501,7 @@ class ScribdDownloader:
                 'error': 'Download timed out (30s). Try again later.'
             }
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             return {
                 'success': False,
                 'data': None,
@@ -248,12 +509,10 @@ class ScribdDownloader:
                 'error': f'Internal error: {str(e)[:100]}'
             }
 
-# ========== TELEGRAM BOT HANDLERS ==========
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Welcome message"""
-    user = update.effective_user
-    welcome = f"""
-✨ *Welcome to Scribd Downloader Bot*, {user.first_name}! ✨
+# ========== BOT MESSAGES ==========
+# Static texts are built once at import; templates only fill in the dynamic parts
+START_TEMPLATE = """
+✨ *Welcome to Scribd Downloader Bot*, {name}! ✨
 
 📚 I can download Scribd documents as PDF files for you.
 
@@ -280,11 +539,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Use /help for more information or just send a link to begin!
 """
-    await update.message.reply_text(welcome, parse_mode=ParseMode.MARKDOWN)
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Help instructions"""
-    help_text = """
+HELP_TEXT = """
 🆘 *Scribd Downloader Bot - Help* 🆘
 
 *Commands:*
@@ -311,34 +567,77 @@ https://scribd.com/presentation/987654321
 
 *Privacy:* I don't store any documents or user data.
 """
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
 
-async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show bot statistics"""
-    stats = context.bot_data.get('stats', {
-        'downloads_success': 0,
-        'downloads_failed': 0,
-        'total_users': 0,
-        'last_success': None
-    })
-    
-    stats_text = f"""
+STATS_TEMPLATE = """
 📊 *Bot Statistics*
 
-✅ Successful downloads: {stats.get('downloads_success', 0)}
-❌ Failed downloads: {stats.get('downloads_failed', 0)}
-👥 Total users served: {stats.get('total_users', 0)}
-🕒 Last success: {stats.get('last_success', 'Never')}
+✅ Successful downloads: {downloads_success}
+❌ Failed downloads: {downloads_failed}
+👥 Total users served: {total_users}
+🕒 Last success: {last_success}
 
 *Uptime:* 24/7
 *Status:* ✅ Operational
 *Version:* 3.0 (Railway Optimized)
 """
-    await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
 
-async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Support information"""
-    support_text = """
+BUSY_TEXT = (
+    "⏳ *You already have a download in progress*\n\n"
+    "Please wait for it to finish before sending another link."
+)
+
+PROCESSING_TEXT = (
+    "⏳ *Processing your request...*\n\n"
+    "Downloading document from Scribd...\n"
+    "This usually takes 10-20 seconds.\n"
+    "_Please wait..._"
+)
+
+SUCCESS_CAPTION_TEMPLATE = """
+✅ *Download Complete!*
+
+📄 *File:* {filename}
+📦 *Size:* {size_kb:.0f} KB
+⚡ *Status:* Successfully downloaded
+
+_Use /help for more options_
+"""
+
+FAILED_TEMPLATE = """
+❌ *Download Failed*
+
+*Reason:* {error}
+
+*Possible solutions:*
+1. Check if the link is correct
+2. Ensure document is publicly accessible
+3. Try a different Scribd document
+4. Remove any tracking parameters from URL
+
+*Alternative:* Try downloading manually from scribd-downloader.co
+"""
+
+UNEXPECTED_ERROR_TEMPLATE = "❌ *Unexpected Error*\n\n`{error}`\n\nPlease try again later."
+
+QUEUE_FULL_TEXT = (
+    "🚦 *The bot is busy right now*\n\n"
+    "Too many downloads are waiting. Please try again in a minute."
+)
+
+NOT_SCRIBD_TEXT = (
+    "🤖 *I only process Scribd links*\n\n"
+    "Please send me a valid Scribd URL like:\n"
+    "`https://www.scribd.com/document/123456789/Title`\n\n"
+    "Use /help for instructions."
+)
+
+BOT_ERROR_TEXT = (
+    "⚠️ *Bot Error*\n\n"
+    "An unexpected error occurred. Please try again.\n"
+    "If problem persists, contact support."
+)
+
+SUPPORT_TEXT = """
 💬 *Support & Contact*
 
 *Developer:* Scribd Downloader Team
@@ -357,10 +656,79 @@ Please respect copyright laws and only download content you have permission to a
 For bug reports or feature requests:
 Contact via GitHub or Telegram channel.
 """
-    await update.message.reply_text(support_text, parse_mode=ParseMode.MARKDOWN)
+
+# ========== TELEGRAM BOT HANDLERS ==========
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Welcome message"""
+    user = update.effective_user
+    await update.message.reply_text(
+        START_TEMPLATE.format(name=escape_markdown(user.first_name)),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Help instructions"""
+    await update.message.reply_text(HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show bot statistics"""
+    stats = context.bot_data.get('stats', {
+        'downloads_success': 0,
+        'downloads_failed': 0,
+        'total_users': 0,
+        'last_success': None
+    })
+    
+    stats_text = STATS_TEMPLATE.format(
+        downloads_success=stats.get('downloads_success', 0),
+        downloads_failed=stats.get('downloads_failed', 0),
+        total_users=stats.get('total_users', 0),
+        last_success=stats.get('last_success', 'Never')
+    )
+    await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
+
+async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Support information"""
+    await update.message.reply_text(SUPPORT_TEXT, parse_mode=ParseMode.MARKDOWN)
 
 async def handle_scribd_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process Scribd links"""
+    """Queue Scribd links for download, allowing one active download per user"""
+    user = update.effective_user
+    
+    # Bounce instead of queueing, so a user can't pile up parallel downloads
+    if user.id in _ACTIVE_USERS:
+        await update.message.reply_text(BUSY_TEXT, parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    # Hand off to the download workers so this update is released immediately
+    try:
+        context.bot_data['download_queue'].put_nowait((update, context))
+    except asyncio.QueueFull:
+        await update.message.reply_text(QUEUE_FULL_TEXT, parse_mode=ParseMode.MARKDOWN)
+        return
+    _ACTIVE_USERS.add(user.id)
+
+async def download_worker(queue: asyncio.Queue):
+    """Process queued Scribd links one at a time"""
+    while True:
+        update, context = await queue.get()
+        try:
+            await process_scribd_link(update, context)
+        except Exception as e:
+            logger.error("Download worker error: %s", e)
+        finally:
+            _ACTIVE_USERS.discard(update.effective_user.id)
+            queue.task_done()
+
+async def reply_status(update: Update, processing_msg, text: str):
+    """Edit the processing message if one was sent, otherwise reply"""
+    if processing_msg:
+        await processing_msg.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+    else:
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+
+async def process_scribd_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Download a Scribd link and send the PDF back"""
     user = update.effective_user
     scribd_url = update.message.text.strip()
     
@@ -373,74 +741,60 @@ async def handle_scribd_link(update: Update, context: ContextTypes.DEFAULT_TYPE)
             'last_success': None
         }
     
-    logger.info(f"User {user.id} requested: {scribd_url[:50]}...")
-    
-    # Send processing message
-    processing_msg = await update.message.reply_text(
-        "⏳ *Processing your request...*\n\n"
-        "Downloading document from Scribd...\n"
-        "This usually takes 10-20 seconds.\n"
-        "_Please wait..._",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    logger.info("User %s requested: %.50s...", user.id, scribd_url)
     
+    processing_msg = None
     try:
         # Download the document
-        async with ScribdDownloader() as downloader:
-            result = await downloader.download_document(scribd_url)
+        downloader = ScribdDownloader(session=context.bot_data['http_session'])
+        download = asyncio.create_task(downloader.download_document(scribd_url))
+        try:
+            # Only show the processing message if the download isn't done quickly
+            done, _ = await asyncio.wait({download}, timeout=PROCESSING_MSG_DELAY)
+            if not done:
+                processing_msg = await update.message.reply_text(PROCESSING_TEXT, parse_mode=ParseMode.MARKDOWN)
+            result = await download
+        finally:
+            # Don't leave the download running if we were cancelled or failed
+            if not download.done():
+                download.cancel()
         
         if result['success']:
             # Update statistics
             context.bot_data['stats']['downloads_success'] += 1
             context.bot_data['stats']['last_success'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
-            # Send the PDF
+            # Send the PDF (BytesIO over bytes shares the buffer, no copy)
+            pdf_file = io.BytesIO(result['data'])
+            pdf_file.name = result['filename']
             await update.message.reply_document(
-                document=InputFile(
-                    result['data'],
-                    filename=result['filename']
+                document=pdf_file,
+                caption=SUCCESS_CAPTION_TEMPLATE.format(
+                    filename=escape_markdown(result['filename']),
+                    size_kb=result['size'] / 1024
                 ),
-                caption=f"""
-✅ *Download Complete!*
-
-📄 *File:* {result['filename']}
-📦 *Size:* {result['size']/1024:.0f} KB
-⚡ *Status:* Successfully downloaded
-
-_Use /help for more options_
-                """,
                 parse_mode=ParseMode.MARKDOWN
             )
             
-            await processing_msg.delete()
-            logger.info(f"Successfully sent PDF to user {user.id}")
+            if processing_msg:
+                await processing_msg.delete()
+            logger.info("Successfully sent PDF to user %s", user.id)
             
         else:
             # Update failed stats
             context.bot_data['stats']['downloads_failed'] += 1
             
-            error_msg = f"""
-❌ *Download Failed*
-
-*Reason:* {result['error']}
-
-*Possible solutions:*
-1. Check if the link is correct
-2. Ensure document is publicly accessible
-3. Try a different Scribd document
-4. Remove any tracking parameters from URL
-
-*Alternative:* Try downloading manually from scribd-downloader.co
-            """
-            
-            await processing_msg.edit_text(error_msg, parse_mode=ParseMode.MARKDOWN)
-            logger.warning(f"Download failed for user {user.id}: {result['error']}")
+            error_msg = FAILED_TEMPLATE.format(error=escape_markdown(result['error']))
+            await reply_status(update, processing_msg, error_msg)
+            logger.warning("Download failed for user %s: %s", user.id, result['error'])
             
     except Exception as e:
-        logger.error(f"Unexpected error for user {user.id}: {e}")
-        await processing_msg.edit_text(
-            f"❌ *Unexpected Error*\n\n`{str(e)[:200]}`\n\nPlease try again later.",
-            parse_mode=ParseMode.MARKDOWN
+        logger.error("Unexpected error for user %s: %s", user.id, e)
+        await reply_status(
+            update,
+            processing_msg,
+            # Code spans can't contain escapes, so just drop backticks
+            UNEXPECTED_ERROR_TEMPLATE.format(error=str(e)[:200].replace('`', "'"))
         )
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -452,30 +806,23 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Check if it's a Scribd URL
-    if 'scribd.com' in text.lower() and ('http://' in text.lower() or 'https://' in text.lower()):
+    low = text.lower()
+    if 'scribd.com' in low and ('http://' in low or 'https://' in low):
         await handle_scribd_link(update, context)
     else:
         await update.message.reply_text(
-            "🤖 *I only process Scribd links*\n\n"
-            "Please send me a valid Scribd URL like:\n"
-            "`https://www.scribd.com/document/123456789/Title`\n\n"
-            "Use /help for instructions.",
+            NOT_SCRIBD_TEXT,
             parse_mode=ParseMode.MARKDOWN,
             disable_web_page_preview=True
         )
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors gracefully"""
-    logger.error(f"Update {update} caused error: {context.error}")
+    logger.error("Update %s caused error: %s", update, context.error)
     
     if update and update.effective_message:
         try:
-            await update.effective_message.reply_text(
-                "⚠️ *Bot Error*\n\n"
-                "An unexpected error occurred. Please try again.\n"
-                "If problem persists, contact support.",
-                parse_mode=ParseMode.MARKDOWN
-            )
+            await update.effective_message.reply_text(BOT_ERROR_TEXT, parse_mode=ParseMode.MARKDOWN)
         except:
             pass
 
@@ -484,21 +831,78 @@ async def health_check():
     """Simple HTTP server for Railway health checks"""
     from aiohttp import web
     
+    # Responses can't be reused across requests, but body and headers can
+    ok_body = b'OK'
+    ok_headers = {'Content-Type': 'text/plain'}
+    
     async def handle_health(request):
-        return web.Response(text='OK', status=200)
+        return web.Response(body=ok_body, status=200, headers=ok_headers)
     
     app = web.Application()
     app.router.add_get('/', handle_health)
     app.router.add_get('/health', handle_health)
     
-    runner = web.AppRunner(app)
+    # Frequent liveness probes shouldn't flood the logs
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
     site = web.TCPSite(runner, '0.0.0.0', PORT)
     await site.start()
     
-    logger.info(f"Health check server running on port {PORT}")
+    logger.info("Health check server running on port %s", PORT)
     return runner
 
+# ========== APPLICATION LIFECYCLE ==========
+async def init_http_session(application: Application):
+    """Create the shared aiohttp session used by every download"""
+    application.bot_data['http_session'] = aiohttp.ClientSession(
+        headers=HTTP_HEADERS,
+        timeout=HTTP_TIMEOUT,
+        connector=aiohttp.TCPConnector(
+            limit=64,
+            limit_per_host=MAX_PER_HOST,
+            keepalive_timeout=120,
+            use_dns_cache=True,
+            ttl_dns_cache=600,
+            enable_cleanup_closed=True,
+            force_close=False
+        )
+    )
+
+async def close_http_session(application: Application):
+    """Close the shared aiohttp session on shutdown"""
+    session = application.bot_data.pop('http_session', None)
+    if session:
+        await session.close()
+
+async def post_init(application: Application):
+    """Create shared resources once, before the first update is handled"""
+    await init_http_session(application)
+    # Plain tasks, not application.create_task: stop() would wait on them forever
+    queue = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    application.bot_data['download_queue'] = queue
+    application.bot_data['download_workers'] = [
+        asyncio.create_task(download_worker(queue)) for _ in range(DOWNLOAD_WORKERS)
+    ]
+    if not WEBHOOK_URL:
+        # In webhook mode PORT belongs to the webhook server
+        application.bot_data['health_runner'] = await health_check()
+
+async def post_shutdown(application: Application):
+    """Release shared resources when the application stops"""
+    workers = application.bot_data.pop('download_workers', [])
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    # Shared fetches are shielded from their callers, so stop them explicitly
+    fetches = list(_INFLIGHT.values())
+    for fetch in fetches:
+        fetch.cancel()
+    await asyncio.gather(*fetches, return_exceptions=True)
+    health_runner = application.bot_data.pop('health_runner', None)
+    if health_runner:
+        await health_runner.cleanup()
+    await close_http_session(application)
+
 # ========== MAIN FUNCTION ==========
 def main():
     """Start the bot with proper Railway configuration"""
@@ -509,11 +913,25 @@ def main():
         return
     
     logger.info("🚀 Starting Scribd Downloader Bot...")
-    logger.info(f"📊 Port: {PORT}")
-    logger.info(f"🌐 Webhook URL: {WEBHOOK_URL or 'Not set (using polling)'}")
+    
+    # Use uvloop's faster event loop where available (not on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("⚡ Using uvloop event loop")
+    except ImportError:
+        logger.info("Using default asyncio event loop")
+    logger.info("📊 Port: %s", PORT)
+    logger.info("🌐 Webhook URL: %s", WEBHOOK_URL or 'Not set (using polling)')
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Store initial stats
     application.bot_data['stats'] = {
@@ -546,46 +964,27 @@ def main():
         # Polling mode (simpler, works with Railway's internal routing)
         logger.info("🔄 Using polling mode")
         
-        # Start health check in background
-        async def run_bot():
-            # Start health check server
-            health_runner = await health_check()
-            
-            # Start bot
-            await application.initialize()
-            await application.start()
-            await application.updater.start_polling()
-            
-            # Keep running
-            await asyncio.Event().wait()
-            
-            # Cleanup
-            await application.updater.stop()
-            await application.stop()
-            await application.shutdown()
-            await health_runner.cleanup()
-        
-        # Run bot
+        # run_polling handles SIGINT/SIGTERM and runs post_init/post_shutdown,
+        # which start and stop the health check server and HTTP session
         try:
-            asyncio.run(run_bot())
-        except KeyboardInterrupt:
-            logger.info("👋 Bot stopped by user")
+            application.run_polling()
         except Exception as e:
-            logger.error(f"❌ Bot crashed: {e}")
+            logger.error("❌ Bot crashed: %s", e)
             raise
+        logger.info("👋 Bot stopped")
 
 if __name__ == '__main__':
     # Check dependencies
     try:
         import aiohttp
         from telegram import __version__ as telegram_version
-        logger.info(f"✅ Dependencies: aiohttp={aiohttp.__version__}, python-telegram-bot={telegram_version}")
+        logger.info("✅ Dependencies: aiohttp=%s, python-telegram-bot=%s", aiohttp.__version__, telegram_version)
         
         # Run the bot
         main()
         
     except ImportError as e:
-        logger.error(f"❌ Missing dependency: {e}")
-        logger.error("Install: pip install python-telegram-bot[job-queue]==20.7 aiohttp")
+        logger.error("❌ Missing dependency: %s", e)
+        logger.error("Install: pip install -r requirements.txt")
         exit(1)
 